@@ -2,7 +2,23 @@
 #
 # Description:
 # This script provides a simple mapping from a detected emotion string
-# to a specific color represented as an RGB tuple.
+# to a specific color represented as an RGB tuple (or a BGR tuple for OpenCV).
+
+# Define the color mappings once, when the module is imported.
+# These colors are chosen to be calming or mood-lifting.
+_COLOR_MAP = {
+    'angry':    (255, 0, 0),      # Red - for clear feedback, though not calming
+    'disgust':  (0, 128, 0),      # Green
+    'fear':     (128, 0, 128),    # Purple
+    'happy':    (255, 255, 0),    # Yellow
+    'sad':      (0, 0, 255),      # Blue
+    'surprise': (255, 165, 0),    # Orange
+    'neutral':  (255, 255, 255)   # White
+}
+# The same colors already reversed into the BGR order OpenCV uses
+_BGR_COLOR_MAP = {emotion: rgb[::-1] for emotion, rgb in _COLOR_MAP.items()}
+# The default color here is a soft white (identical in RGB and BGR).
+_DEFAULT_COLOR = (200, 200, 200)
 
 def get_color_for_emotion(emotion):
     """
@@ -15,22 +31,22 @@ def get_color_for_emotion(emotion):
         A tuple representing an RGB color (R, G, B), or a default color
         if the emotion is not recognized or is None.
     """
-    # Define the color mappings
-    # These colors are chosen to be calming or mood-lifting.
-    color_map = {
-        'angry':    (255, 0, 0),      # Red - for clear feedback, though not calming
-        'disgust':  (0, 128, 0),      # Green
-        'fear':     (128, 0, 128),    # Purple
-        'happy':    (255, 255, 0),    # Yellow
-        'sad':      (0, 0, 255),      # Blue
-        'surprise': (255, 165, 0),    # Orange
-        'neutral':  (255, 255, 255)   # White
-    }
-    
     # Return the color for the given emotion.
     # .get() is used to provide a default value if the emotion is not in the map.
-    # The default color here is a soft white.
-    return color_map.get(emotion, (200, 200, 200))
+    return _COLOR_MAP.get(emotion, _DEFAULT_COLOR)
+
+def get_bgr_for_emotion(emotion):
+    """
+    Maps an emotion string to a BGR color tuple, ready for use with OpenCV.
+
+    Args:
+        emotion (str): The detected emotion (e.g., 'happy', 'sad', 'angry').
+
+    Returns:
+        A tuple representing a BGR color (B, G, R), or a default color
+        if the emotion is not recognized or is None.
+    """
+    return _BGR_COLOR_MAP.get(emotion, _DEFAULT_COLOR)
 
 # --- Example Usage ---
 if __name__ == '__main__':
@@ -40,5 +56,6 @@ if __name__ == '__main__':
     print("Testing color mappings:")
     for emotion in test_emotions:
         color = get_color_for_emotion(emotion)
-        print(f"Emotion: {emotion}, Mapped Color (RGB): {color}")
+        bgr_color = get_bgr_for_emotion(emotion)
+        print(f"Emotion: {emotion}, Mapped Color (RGB): {color}, (BGR): {bgr_color}")
 
@@ -9,150 +9,406 @@
 # Dependencies:
 # - All previous libraries plus 'deepface'.
 # - All helper scripts ('screen_flasher.py', 'emotion_detector.py',
-#   'color_mapper.py') must be in the same directory.
+#   'color_mapper.py', 'threaded_capture.py') must be in the same directory.
+# - dlib's face detector is much faster with SIMD enabled. Prebuilt wheels
+#   often have it turned off, so build dlib from source instead:
+#     x86: CMAKE_ARGS="-DUSE_AVX_INSTRUCTIONS=ON -DDLIB_USE_CUDA=OFF" \
+#          pip install --no-binary dlib dlib
+#     ARM: CMAKE_ARGS="-DUSE_NEON_INSTRUCTIONS=ON -DDLIB_USE_CUDA=OFF" \
+#          pip install --no-binary dlib dlib
+#   For an extra boost, build once with CFLAGS/CXXFLAGS="-O3 -fprofile-generate",
+#   run this script for a while, then rebuild with "-O3 -fprofile-use".
+# - Optional: 'numba' compiles the eye aspect ratio math to native code.
+#
+# Usage:
+#   python detector.py               # show the annotated video window
+#   python detector.py --headless    # no video window; log the emotion once a second
+#   python detector.py --no-flash    # sound alarm only, no flashing screen
+#   python detector.py --no-emotion  # drowsiness detection only
 
+import argparse
 import cv2
 import dlib
-from scipy.spatial import distance as dist
 import pygame
+import signal
+import threading
 import time
+import tkinter as tk
+import platform
 import numpy as np
 
 # Import our custom helper modules
 from screen_flasher import ScreenFlasher
-from emotion_detector import EmotionDetector
-from color_mapper import get_color_for_emotion
+from emotion_detector import EmotionProcess
+from color_mapper import get_bgr_for_emotion
+from threaded_capture import ThreadedCapture
+
+# numba is optional; without it the eye math simply runs as regular Python
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        return lambda func: func
 
 # --- Constants and Configuration ---
 EYE_AR_THRESH = 0.23
 EYE_AR_CONSEC_FRAMES = 35
 # How often to run emotion detection (e.g., once every 15 frames)
 EMOTION_CHECK_INTERVAL = 15 
+# Face detection runs on a frame shrunk by this factor (landmarks still use full size)
+DETECTION_SCALE = 0.5
+# How often to re-run face detection; the face boxes are reused in between
+DETECT_INTERVAL = 5
+# Re-detect early if the landmarks move more than this fraction of the face width
+FACE_DRIFT_THRESH = 0.25
 
 # --- Function to Calculate Eye Aspect Ratio (EAR) ---
+# Written with plain arithmetic on the (6, 2) eye array so numba can compile it
+@njit(cache=True, fastmath=True)
 def eye_aspect_ratio(eye):
-    A = dist.euclidean(eye[1], eye[5])
-    B = dist.euclidean(eye[2], eye[4])
-    C = dist.euclidean(eye[0], eye[3])
+    A = np.sqrt(float(eye[1, 0] - eye[5, 0]) ** 2 + float(eye[1, 1] - eye[5, 1]) ** 2)
+    B = np.sqrt(float(eye[2, 0] - eye[4, 0]) ** 2 + float(eye[2, 1] - eye[4, 1]) ** 2)
+    C = np.sqrt(float(eye[0, 0] - eye[3, 0]) ** 2 + float(eye[0, 1] - eye[3, 1]) ** 2)
     ear = (A + B) / (2.0 * C)
     return ear
 
-# --- Initialization ---
-print("[INFO] Initializing...")
+# --- Function to Convert dlib Landmarks to a NumPy Array ---
+def shape_to_np(shape):
+    # Stream the x, y values straight into a (68, 2) array so the eyes can be
+    # sliced as views. dlib's points are Python objects, so numba can't help here.
+    n = shape.num_parts
+    coords = np.fromiter((v for p in shape.parts() for v in (p.x, p.y)),
+                         dtype=np.int32, count=2 * n)
+    return coords.reshape(n, 2)
 
-# Initialize dlib for drowsiness detection
-print("[INFO] Loading facial landmark predictor...")
-drowsiness_detector = dlib.get_frontal_face_detector()
-predictor = dlib.shape_predictor('shape_predictor_68_face_landmarks.dat')
-(lStart, lEnd) = (42, 48)
-(rStart, rEnd) = (36, 42)
-
-# Initialize Pygame for sound
-try:
-    pygame.mixer.init()
-    alarm_sound_path = 'alarm.wav'
-    pygame.mixer.music.load(alarm_sound_path)
-    print(f"[INFO] Alarm sound '{alarm_sound_path}' loaded.")
-except pygame.error as e:
-    print(f"[ERROR] Could not load alarm sound: {e}")
-    alarm_sound_path = None
-
-# Initialize our custom modules
-print("[INFO] Initializing screen flasher...")
-flasher = ScreenFlasher()
-print("[INFO] Initializing emotion detector...")
-emotion_detector = EmotionDetector()
-
-# Start video stream
-print("[INFO] Starting video stream...")
-cap = cv2.VideoCapture(0)
-time.sleep(1.0)
-
-# Counters and status variables
-drowsiness_frame_counter = 0
-emotion_check_counter = 0
-alarm_on = False
-last_detected_emotion = "neutral" # Start with a default emotion
-
-# --- Main Video Processing Loop ---
-while True:
-    ret, frame = cap.read()
-    if not ret:
-        break
-
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    rects = drowsiness_detector(gray, 0)
-
-    # --- Emotion Detection Logic ---
-    # Only check for emotion every N frames to save resources
-    if emotion_check_counter % EMOTION_CHECK_INTERVAL == 0:
-        # We run analysis on a copy of the frame
-        detected_emotion = emotion_detector.analyze_frame(frame.copy())
-        if detected_emotion:
-            last_detected_emotion = detected_emotion
-    emotion_check_counter += 1
-
-    # --- Drowsiness Detection Logic ---
-    for rect in rects:
-        shape = predictor(gray, rect)
-        coords = [ (shape.part(i).x, shape.part(i).y) for i in range(68) ]
-
-        leftEye = coords[lStart:lEnd]
-        rightEye = coords[rStart:rEnd]
-        
-        leftEAR = eye_aspect_ratio(leftEye)
-        rightEAR = eye_aspect_ratio(rightEye)
-
-        leftEyeHull = cv2.convexHull(np.array(leftEye))
-        rightEyeHull = cv2.convexHull(np.array(rightEye))
-        cv2.drawContours(frame, [leftEyeHull], -1, (0, 255, 0), 1)
-        cv2.drawContours(frame, [rightEyeHull], -1, (0, 255, 0), 1)
-
-        if leftEAR < EYE_AR_THRESH and rightEAR < EYE_AR_THRESH:
-            drowsiness_frame_counter += 1
-            if drowsiness_frame_counter >= EYE_AR_CONSEC_FRAMES and not alarm_on:
-                alarm_on = True
-                print("[ALERT] Drowsiness Detected!")
-                if alarm_sound_path:
-                    pygame.mixer.music.play(-1)
-        else:
-            drowsiness_frame_counter = 0
-            if alarm_on:
-                alarm_on = False
-                if alarm_sound_path:
-                    pygame.mixer.music.stop()
-    
-    # --- Visual Updates ---
-    # Handle screen flashing for drowsiness
+# --- Function to Draw the Text and Color Swatch Overlay ---
+def build_overlay(frame_shape, emotion, alarm_on):
+    # Draw onto a transparent BGRA layer; anything drawn gets alpha 255
+    (H, W) = frame_shape[:2]
+    overlay = np.zeros((H, W, 4), dtype=np.uint8)
     if alarm_on:
-        # Simple flash logic: on for 5 frames, off for 5
-        if (emotion_check_counter // 5) % 2 == 0:
-            flasher.set_flash_state(True)
-        else:
-            flasher.set_flash_state(False)
-        cv2.putText(frame, "DROWSINESS ALERT!", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
-    else:
-        flasher.set_flash_state(False)
-
-    # Display emotion and color swatch
-    emotion_color = get_color_for_emotion(last_detected_emotion)
-    # Note: OpenCV uses BGR format, so we reverse the RGB tuple
-    bgr_emotion_color = emotion_color[::-1] 
-    
-    cv2.putText(frame, f"Emotion: {last_detected_emotion}", (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-    # Draw a rectangle to represent the ambient lamp color
-    cv2.rectangle(frame, (frame.shape[1] - 60, 10), (frame.shape[1] - 10, 60), bgr_emotion_color, -1)
-
-    # Show the final frame
-    cv2.imshow("Emotion-Detecting Study Lamp", frame)
-    key = cv2.waitKey(1) & 0xFF
-
-    if key == ord("q"):
-        break
-
-# --- Cleanup ---
-print("[INFO] Cleaning up...")
-cv2.destroyAllWindows()
-cap.release()
-pygame.mixer.quit()
-flasher.close()
+        cv2.putText(overlay, "DROWSINESS ALERT!", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255, 255), 2)
+
+    # Display emotion and color swatch (skipped when emotion detection is off)
+    if emotion is not None:
+        # Note: OpenCV uses BGR format, so we ask for the BGR color directly
+        bgr_emotion_color = get_bgr_for_emotion(emotion)
+
+        cv2.putText(overlay, f"Emotion: {emotion}", (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0, 255), 2)
+        # Draw a rectangle to represent the ambient lamp color
+        cv2.rectangle(overlay, (W - 60, 10), (W - 10, 60), (*bgr_emotion_color, 255), -1)
+
+    # Crop to the bounding box of the drawn pixels (just the top strip), so
+    # each frame only has to copy that small region
+    drawn = overlay[:, :, 3] > 0
+    rows = np.flatnonzero(drawn.any(axis=1))
+    cols = np.flatnonzero(drawn.any(axis=0))
+    if rows.size == 0:
+        return None, None, None
+    region = (slice(int(rows[0]), int(rows[-1]) + 1), slice(int(cols[0]), int(cols[-1]) + 1))
+
+    # Split into the colors and a mask of the drawn pixels, ready for np.copyto
+    overlay = overlay[region]
+    return np.ascontiguousarray(overlay[:, :, :3]), overlay[:, :, 3:] > 0, region
+
+# --- The Detector ---
+class DrowsinessEmotionDetector:
+    """
+    Runs the drowsiness alarm and, optionally, the flashing screen and the
+    emotion lamp. Every model, sound and helper is created exactly once, here.
+    """
+    def __init__(self, enable_flash=True, enable_emotion=True, headless=False, src=0):
+        """
+        Loads the models and sets up the helpers that are enabled.
+
+        Args:
+            enable_flash: Flash the screen white while the alarm is on.
+            enable_emotion: Detect the user's emotion and show the lamp color.
+            headless: Don't draw or show the video window; log the state instead.
+            src: The camera index or video path to read from.
+        """
+        self.headless = headless
+        self.src = src
+
+        print("[INFO] Initializing...")
+
+        # Initialize dlib for drowsiness detection
+        print("[INFO] Loading facial landmark predictor...")
+        self.drowsiness_detector = dlib.get_frontal_face_detector()
+        self.predictor = dlib.shape_predictor('shape_predictor_68_face_landmarks.dat')
+        (self.lStart, self.lEnd) = (42, 48)
+        (self.rStart, self.rEnd) = (36, 42)
+
+        # Warn if dlib was built without the SIMD instructions this CPU supports
+        machine = platform.machine().lower()
+        if machine in ('x86_64', 'amd64') and not getattr(dlib, 'USE_AVX_INSTRUCTIONS', True):
+            print("[WARNING] dlib was built without AVX; face detection will be slower.")
+        elif machine in ('aarch64', 'arm64') and not getattr(dlib, 'USE_NEON_INSTRUCTIONS', True):
+            print("[WARNING] dlib was built without NEON; face detection will be slower.")
+
+        # Initialize Pygame for sound. The alarm is decoded into memory once and
+        # played on its own channel, so starting and stopping it is instant.
+        try:
+            pygame.mixer.init()
+            alarm_sound_path = 'alarm.wav'
+            self.alarm_sound = pygame.mixer.Sound(alarm_sound_path)
+            # Reserve channel 0 so no other Sound.play() can take it over
+            pygame.mixer.set_reserved(1)
+            self.alarm_channel = pygame.mixer.Channel(0)
+            print(f"[INFO] Alarm sound '{alarm_sound_path}' loaded.")
+        except pygame.error as e:
+            print(f"[ERROR] Could not load alarm sound: {e}")
+            self.alarm_sound = None
+
+        # Initialize our custom modules
+        self.flasher = None
+        if enable_flash:
+            print("[INFO] Initializing screen flasher...")
+            try:
+                self.flasher = ScreenFlasher()
+            except tk.TclError as e:
+                # No display (e.g. a headless deployment); the sound alarm still works
+                print(f"[WARNING] Could not open the screen flasher, continuing without it: {e}")
+        self.emotion_worker = None
+        if enable_emotion:
+            print("[INFO] Initializing emotion detector...")
+            # Emotion analysis runs in its own process to stay clear of the GIL
+            self.emotion_worker = EmotionProcess()
+
+        # Counters and status variables
+        self.frame_counter = 0
+        self.drowsiness_frame_counter = 0
+        self.detection_frame_counter = 0
+        self.force_detection = False
+        self.last_rects = []
+        self.alarm_on = False
+        self.stop_requested = False
+        self.capture = None
+        self.has_run = False
+        self.closed = False
+        # Start with a default emotion (None when emotion detection is off)
+        self.last_detected_emotion = "neutral" if enable_emotion else None
+        # Grayscale buffers, allocated once from the first frame and reused every loop
+        self.gray_buf = None
+        self.small_buf = None
+        self.small_size = None
+        # The text/swatch overlay only changes with the emotion or alarm, so it is
+        # drawn once per change and then copied onto every frame
+        self.overlay_key = None
+        self.overlay_bgr = None
+        self.overlay_mask = None
+        self.overlay_region = None
+
+    def stop(self):
+        """
+        Asks the main loop to finish after the current frame.
+        """
+        self.stop_requested = True
+
+    def run(self):
+        """
+        Runs the main video processing loop until 'q' is pressed, the video
+        ends, or stop() is called, then cleans up with close().
+
+        A detector can only be run once, because close() releases the sound,
+        flasher and emotion process; create a new one to run again.
+        """
+        if self.has_run or self.closed:
+            raise RuntimeError("DrowsinessEmotionDetector.run() can only be called once")
+        self.has_run = True
+
+        last_log_time = 0.0
+        previous_handlers = {}
+        try:
+            # Stop cleanly on Ctrl+C or a termination signal (the only way out when
+            # headless). Signal handlers can only be set from the main thread; when
+            # run() is called from another thread, use stop() instead.
+            if threading.current_thread() is threading.main_thread():
+                for signum in (signal.SIGINT, signal.SIGTERM):
+                    previous_handlers[signum] = signal.signal(
+                        signum, lambda signum, frame: self.stop())
+
+            if self.emotion_worker:
+                self.emotion_worker.start()
+
+            # Start video stream
+            print("[INFO] Starting video stream...")
+            self.capture = ThreadedCapture(self.src).start()
+            time.sleep(1.0)
+
+            # --- Main Video Processing Loop ---
+            while not self.stop_requested:
+                frame, frame_time = self.capture.read()
+                if frame is None:
+                    break
+
+                self._process(frame)
+                # Time from the frame arriving from the camera to it being processed
+                frame_latency = time.monotonic() - frame_time
+
+                if self.headless:
+                    # No window to draw on, so just report the state once a second
+                    now = time.time()
+                    if now - last_log_time >= 1.0:
+                        print(f"[INFO] Emotion: {self.last_detected_emotion}, Drowsy: {self.alarm_on}, "
+                              f"Frame latency: {frame_latency * 1000:.0f} ms")
+                        last_log_time = now
+                    continue
+
+                self._draw_overlay(frame)
+
+                # Show the final frame
+                cv2.imshow("Emotion-Detecting Study Lamp", frame)
+                key = cv2.waitKey(1) & 0xFF
+
+                if key == ord("q"):
+                    break
+        finally:
+            self.close()
+            # Put back whatever handlers were installed before run()
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+
+    def close(self):
+        """
+        Releases the camera, emotion process (and its shared memory), sound and
+        screen flasher. run() calls this when it finishes; call it yourself if
+        you create a detector but never run it. Safe to call more than once.
+        """
+        if self.closed:
+            return
+        self.closed = True
+
+        # --- Cleanup ---
+        print("[INFO] Cleaning up...")
+        if not self.headless:
+            cv2.destroyAllWindows()
+        if self.capture:
+            self.capture.release()
+        if self.emotion_worker:
+            self.emotion_worker.stop()
+        pygame.mixer.quit()
+        if self.flasher:
+            self.flasher.close()
+
+    def _process(self, frame):
+        """
+        Runs face detection, emotion checks and drowsiness detection on one frame,
+        and updates the alarm and screen flasher.
+        """
+        if self.gray_buf is None or self.gray_buf.shape != frame.shape[:2]:
+            (H, W) = frame.shape[:2]
+            self.small_size = (int(W * DETECTION_SCALE), int(H * DETECTION_SCALE))
+            self.gray_buf = np.empty((H, W), dtype=np.uint8)
+            self.small_buf = np.empty((self.small_size[1], self.small_size[0]), dtype=np.uint8)
+
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self.gray_buf)
+        # Only run face detection every N frames, or straight away if the face
+        # was lost or moved too far; otherwise reuse the previous face boxes
+        if (self.force_detection or not self.last_rects
+                or self.detection_frame_counter % DETECT_INTERVAL == 0):
+            # Detect faces on a smaller copy, then scale the boxes back up
+            small = cv2.resize(gray, self.small_size, dst=self.small_buf, interpolation=cv2.INTER_AREA)
+            self.last_rects = [
+                dlib.rectangle(int(r.left() / DETECTION_SCALE), int(r.top() / DETECTION_SCALE),
+                               int(r.right() / DETECTION_SCALE), int(r.bottom() / DETECTION_SCALE))
+                for r in self.drowsiness_detector(small, 0)
+            ]
+            self.detection_frame_counter = 0
+            self.force_detection = False
+        rects = self.last_rects
+        self.detection_frame_counter += 1
+
+        # --- Emotion Detection Logic ---
+        # Only check for emotion every N frames to save resources.
+        # The analysis runs in a worker process, so this never blocks the loop;
+        # if the worker falls too far behind the frame is simply skipped.
+        if self.emotion_worker:
+            if self.frame_counter % EMOTION_CHECK_INTERVAL == 0 and rects:
+                # We run analysis on the faces already found by dlib, all of them
+                # in one batch; the first face sets the displayed emotion.
+                # The crops are copied into shared memory, so no .copy() is needed.
+                face_crops = [
+                    frame[max(0, r.top()):r.bottom(), max(0, r.left()):r.right()]
+                    for r in rects
+                ]
+                self.emotion_worker.submit(face_crops)
+            detected_emotion = self.emotion_worker.get_latest()
+            if detected_emotion:
+                self.last_detected_emotion = detected_emotion
+        self.frame_counter += 1
+
+        # --- Drowsiness Detection Logic ---
+        for rect in rects:
+            shape = self.predictor(gray, rect)
+            coords = shape_to_np(shape)
+
+            # If the landmarks have drifted away from the reused box, re-detect next frame
+            landmark_center = (coords.min(axis=0) + coords.max(axis=0)) / 2.0
+            rect_center = np.array([rect.center().x, rect.center().y])
+            if np.abs(landmark_center - rect_center).max() > FACE_DRIFT_THRESH * rect.width():
+                self.force_detection = True
+
+            leftEye = coords[self.lStart:self.lEnd]
+            rightEye = coords[self.rStart:self.rEnd]
+
+            leftEAR = eye_aspect_ratio(leftEye)
+            rightEAR = eye_aspect_ratio(rightEye)
+
+            if not self.headless:
+                # The eye landmarks already go around each eye in order, so draw
+                # them directly as closed outlines instead of computing convex hulls
+                cv2.polylines(frame, [leftEye, rightEye], isClosed=True, color=(0, 255, 0), thickness=1)
+
+            if leftEAR < EYE_AR_THRESH and rightEAR < EYE_AR_THRESH:
+                self.drowsiness_frame_counter += 1
+                if self.drowsiness_frame_counter >= EYE_AR_CONSEC_FRAMES and not self.alarm_on:
+                    self.alarm_on = True
+                    print("[ALERT] Drowsiness Detected!")
+                    if self.alarm_sound and not self.alarm_channel.get_busy():
+                        self.alarm_channel.play(self.alarm_sound, loops=-1)
+            else:
+                self.drowsiness_frame_counter = 0
+                if self.alarm_on:
+                    self.alarm_on = False
+                    if self.alarm_sound:
+                        self.alarm_channel.stop()
+
+        # --- Visual Updates ---
+        # Handle screen flashing for drowsiness
+        if self.flasher:
+            if self.alarm_on:
+                # Simple flash logic: on for 5 frames, off for 5
+                self.flasher.set_flash_state((self.frame_counter // 5) % 2 == 0)
+            else:
+                self.flasher.set_flash_state(False)
+
+    def _draw_overlay(self, frame):
+        """
+        Copies the alert text, emotion and color swatch onto the frame.
+        """
+        # Redraw the overlay only when what it shows has changed
+        overlay_state = (self.last_detected_emotion, self.alarm_on, frame.shape)
+        if overlay_state != self.overlay_key:
+            self.overlay_bgr, self.overlay_mask, self.overlay_region = build_overlay(
+                frame.shape, self.last_detected_emotion, self.alarm_on)
+            self.overlay_key = overlay_state
+        if self.overlay_region is not None:
+            np.copyto(frame[self.overlay_region], self.overlay_bgr, where=self.overlay_mask)
+
+# --- Main Program ---
+# Everything below only runs when this file is executed directly. The guard
+# matters because the emotion process re-imports this module when it starts.
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Drowsiness & emotion detecting study lamp.")
+    parser.add_argument("--headless", action="store_true",
+                        help="don't draw or show the video window; log the emotion to stdout instead")
+    parser.add_argument("--no-flash", action="store_true",
+                        help="don't flash the screen when drowsiness is detected")
+    parser.add_argument("--no-emotion", action="store_true",
+                        help="turn off emotion detection and the lamp color")
+    args = parser.parse_args()
+
+    DrowsinessEmotionDetector(enable_flash=not args.no_flash,
+                              enable_emotion=not args.no_emotion,
+                              headless=args.headless).run()
@@ -1,75 +1,367 @@
 # Emotion Detector Script
 #
 # Description:
-# This script uses the 'deepface' library to analyze a video frame (as a NumPy array)
-# and determine the dominant emotion of the face present in the frame.
+# This script uses the 'deepface' library to analyze a cropped face image
+# (as a NumPy array) and determine its dominant emotion. Face detection is
+# left to the caller (e.g. dlib), so DeepFace doesn't have to search for it again.
 #
 # Dependencies:
 # - deepface (which includes tensorflow, opencv-python, and numpy)
 
-from deepface import DeepFace
+import cv2
+import numpy as np
 import logging
+import multiprocessing
+import os
+import queue
+import signal
+import tempfile
+import threading
+from multiprocessing import shared_memory
 
 # Optional: Suppress the detailed, often lengthy, logging from deepface
 # You can comment this out if you want to see the backend messages.
 logging.getLogger('deepface').setLevel(logging.ERROR)
 
+# The emotion model works on 48x48 faces, so crops are shrunk to this size up front
+EMOTION_INPUT_SIZE = (48, 48)
+# The emotion labels, in the order of the model's output scores
+EMOTIONS = ['angry', 'disgust', 'fear', 'happy', 'sad', 'surprise', 'neutral']
+# Where the FP16 TensorFlow Lite copy of the emotion model is cached
+EMOTION_TFLITE_PATH = 'emotion_model_fp16.tflite'
+# The most face crops the worker will run through the model in one call
+EMOTION_BATCH_SIZE = 4
+
 
 class EmotionDetector:
     """
     A class to detect emotions from an image frame.
     """
-    def __init__(self):
+    def __init__(self, use_tflite=True):
         """
         The constructor for the EmotionDetector class.
-        DeepFace handles its own model loading on the first run, so
-        we don't need to initialize much here.
+        Loads the emotion model once here, so that each call to
+        analyze_frame() only has to run inference.
+
+        Args:
+            use_tflite: If True, run a half-precision (FP16) TensorFlow Lite copy
+                of the model, which is faster on CPU. Falls back to the regular
+                Keras model if the conversion isn't possible.
+        """
+        self.model = None
+        # The TFLite interpreter isn't thread-safe, so only one thread may run
+        # the model (and resize its input) at a time
+        self._model_lock = threading.Lock()
+        self.interpreter = None
+        if use_tflite:
+            try:
+                self._load_tflite_model()
+            except Exception as e:
+                print(f"[WARNING] Could not use TensorFlow Lite, falling back to Keras: {e}")
+                self.interpreter = None
+        if self.interpreter is not None:
+            # Inference goes through TFLite, so the Keras model isn't needed
+            self.model = None
+        elif self.model is None:
+            # Reuse the Keras model if the TFLite conversion already built it
+            self.model = self._build_keras_model()
+
+    def _build_keras_model(self):
+        """
+        Builds DeepFace's emotion model and returns the underlying Keras model.
+        """
+        # Imported here so that TensorFlow is only loaded by the process that
+        # actually runs the model, not by everything that imports this module
+        from deepface import DeepFace
+
+        try:
+            model = DeepFace.build_model(model_name='Emotion', task='facial_attribute')
+        except TypeError:
+            # Older DeepFace versions don't take a 'task' argument
+            model = DeepFace.build_model('Emotion')
+        # Newer DeepFace versions wrap the Keras model in a client object
+        return getattr(model, 'model', model)
+
+    def _load_tflite_model(self):
+        """
+        Loads the FP16 TensorFlow Lite model, converting and caching it
+        from the Keras model the first time.
         """
-        pass
+        import tensorflow as tf
+
+        if not os.path.exists(EMOTION_TFLITE_PATH):
+            # Kept on self.model so a failure below can fall back to it
+            # without building the model a second time
+            self.model = self._build_keras_model()
+            converter = tf.lite.TFLiteConverter.from_keras_model(self.model)
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+            converter.target_spec.supported_types = [tf.float16]
+            tflite_model = converter.convert()
+            # Write to a uniquely named temporary file first, so a failed write or
+            # another process converting at the same time never leaves a broken cache
+            cache_dir = os.path.dirname(os.path.abspath(EMOTION_TFLITE_PATH))
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix='emotion_model_fp16.',
+                                            suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(tflite_model)
+                os.replace(tmp_path, EMOTION_TFLITE_PATH)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
 
-    def analyze_frame(self, frame):
+        self.interpreter = tf.lite.Interpreter(model_path=EMOTION_TFLITE_PATH,
+                                               num_threads=os.cpu_count())
+        self.interpreter.allocate_tensors()
+        self._input_index = self.interpreter.get_input_details()[0]['index']
+        self._output_index = self.interpreter.get_output_details()[0]['index']
+        self._batch_size = 1
+
+    def analyze_frame(self, face_crop):
         """
-        Analyzes a single video frame to detect the dominant emotion.
+        Analyzes a cropped face image to detect the dominant emotion.
 
         Args:
-            frame: A NumPy array representing the video frame (in BGR format from OpenCV).
+            face_crop: A NumPy array containing just the face (in BGR format from OpenCV).
 
         Returns:
             A string representing the dominant emotion (e.g., 'happy', 'sad', 'neutral'),
-            or None if no face is detected or an error occurs.
+            or None if the crop is empty or an error occurs.
+        """
+        return self.analyze_faces([face_crop])[0]
+
+    def analyze_faces(self, face_crops):
+        """
+        Analyzes several cropped face images with a single call to the model,
+        which is much cheaper than analyzing them one at a time.
+
+        Args:
+            face_crops: A list of NumPy arrays, each containing just one face (BGR).
+
+        Returns:
+            A list with the dominant emotion for each crop, in the same order.
+            An entry is None if that crop is empty or an error occurs.
         """
+        emotions = [None] * len(face_crops)
+        valid = [i for i, crop in enumerate(face_crops) if crop is not None and crop.size > 0]
+        if not valid:
+            return emotions
+
         try:
-            # DeepFace's analyze function can detect emotion, age, gender, and race.
-            # We specify that we only want to analyze 'emotion'.
-            # It returns a list of dictionaries, one for each face found.
-            analysis_result = DeepFace.analyze(
-                img_path=frame,
-                actions=['emotion'],
-                enforce_detection=True, # Ensures it doesn't try to analyze a frame with no face
-                silent=True # Hides the progress bar for a cleaner output
-            )
-            
-            # The result is a list, we'll take the first face found.
-            if analysis_result and len(analysis_result) > 0:
-                # The dominant emotion is stored in the 'dominant_emotion' key.
-                dominant_emotion = analysis_result[0]['dominant_emotion']
-                return dominant_emotion
-            else:
-                return None
+            # The model expects a batch of 48x48 grayscale faces scaled to [0, 1]
+            model_input = np.empty((len(valid), *EMOTION_INPUT_SIZE, 1), dtype=np.float32)
+            for row, i in enumerate(valid):
+                face_crop = cv2.resize(face_crops[i], EMOTION_INPUT_SIZE, interpolation=cv2.INTER_AREA)
+                model_input[row, :, :, 0] = cv2.cvtColor(face_crop, cv2.COLOR_BGR2GRAY)
+            model_input /= 255.0
+
+            # Call the model directly rather than DeepFace.analyze(), which
+            # adds detection, action dispatch and result formatting we don't need.
+            with self._model_lock:
+                if self.interpreter is not None:
+                    # The TFLite input shape is fixed, so resize it when the batch size changes
+                    if self._batch_size != len(valid):
+                        self.interpreter.resize_tensor_input(self._input_index, model_input.shape)
+                        self.interpreter.allocate_tensors()
+                        self._batch_size = len(valid)
+                    self.interpreter.set_tensor(self._input_index, model_input)
+                    self.interpreter.invoke()
+                    # Copy the scores out before another call can overwrite them
+                    scores = self.interpreter.get_tensor(self._output_index).copy()
+                else:
+                    scores = self.model.predict(model_input, verbose=0)
+
+            for i, face_scores in zip(valid, scores):
+                emotions[i] = EMOTIONS[int(np.argmax(face_scores))]
+            return emotions
 
         except Exception as e:
-            # DeepFace will raise an exception if it cannot find a face in the image.
-            # We catch this and return None, so our main program doesn't crash.
-            # print(f"No face detected or error in analysis: {e}")
+            # We catch any analysis error and return None, so our main program doesn't crash.
+            # print(f"Error in emotion analysis: {e}")
+            return emotions
+
+
+def _collect_submissions(in_queue, count_faces):
+    """
+    Waits for one submission, then takes any others already waiting, until
+    EMOTION_BATCH_SIZE faces have been collected.
+
+    Args:
+        in_queue: The queue that submissions arrive on.
+        count_faces: A function returning the number of faces in a submission.
+
+    Returns:
+        A tuple (submissions, running). 'running' is False once the None
+        sentinel has been received.
+    """
+    submissions = [in_queue.get()]
+    while sum(count_faces(s) for s in submissions if s is not None) < EMOTION_BATCH_SIZE:
+        try:
+            submissions.append(in_queue.get_nowait())
+        except queue.Empty:
+            break
+    running = None not in submissions
+    return [s for s in submissions if s is not None], running
+
+
+def _run_emotion_process(shm_name, slots_shape, in_queue, emotion_id, use_tflite):
+    """
+    The body of the emotion process. Reads face crops from shared memory and
+    writes the index of the latest emotion into 'emotion_id'.
+    """
+    # Ctrl+C reaches every process in the terminal, but shutting down is the
+    # main process's job: it sends the None sentinel, so ignore SIGINT here
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    slots = np.ndarray(slots_shape, dtype=np.uint8, buffer=shm.buf)
+    # The model is loaded here, inside the process that uses it
+    detector = EmotionDetector(use_tflite=use_tflite)
+
+    face_crops = []
+    running = True
+    while running:
+        submissions, running = _collect_submissions(in_queue, lambda s: s[1])
+        if not submissions:
+            break
+
+        face_crops = [slots[slot, i] for slot, n in submissions for i in range(n)]
+        emotions = detector.analyze_faces(face_crops)
+        # Report the first face of the newest submission, and keep the
+        # previous emotion if the analysis failed this time
+        emotion = emotions[len(face_crops) - submissions[-1][1]]
+        if emotion:
+            emotion_id.value = EMOTIONS.index(emotion)
+
+    # Drop our views of the shared memory before closing it
+    del face_crops, slots
+    shm.close()
+
+
+class EmotionProcess:
+    """
+    Runs emotion analysis in a separate process, so TensorFlow doesn't compete
+    with the main loop for Python's GIL. Face crops are passed through shared
+    memory; only small slot numbers go through the queue.
+
+    Usage: start(), then submit() face crops and poll get_latest() from the
+    main loop, and call stop() when done.
+    """
+    def __init__(self, use_tflite=True):
+        """
+        Allocates the shared-memory slots and the queue for incoming face crops.
+
+        Args:
+            use_tflite: Passed on to the EmotionDetector built in the worker process.
+        """
+        # Up to EMOTION_BATCH_SIZE submissions can wait in the queue while the
+        # worker holds as many again, so one more slot than that is never in use
+        num_slots = 2 * EMOTION_BATCH_SIZE + 1
+        self._slots_shape = (num_slots, EMOTION_BATCH_SIZE, *EMOTION_INPUT_SIZE[::-1], 3)
+        self._shm = shared_memory.SharedMemory(create=True, size=int(np.prod(self._slots_shape)))
+        self._slots = np.ndarray(self._slots_shape, dtype=np.uint8, buffer=self._shm.buf)
+        self._next_slot = 0
+
+        # Use 'spawn' everywhere so TensorFlow always starts in a fresh process
+        ctx = multiprocessing.get_context('spawn')
+        self._in = ctx.Queue(maxsize=EMOTION_BATCH_SIZE)
+        self._emotion_id = ctx.Value('i', -1)
+        self._process = ctx.Process(
+            target=_run_emotion_process,
+            args=(self._shm.name, self._slots_shape, self._in, self._emotion_id, use_tflite),
+            daemon=True,
+        )
+        self._worker_died = False
+
+    def start(self):
+        """
+        Starts the worker process.
+        """
+        self._process.start()
+
+    def _worker_alive(self):
+        """
+        Returns False once the worker process has exited on its own (for example
+        because the model failed to load), warning about it the first time.
+        """
+        if self._worker_died:
+            return False
+        if self._process.pid is not None and not self._process.is_alive():
+            print(f"[ERROR] The emotion process exited unexpectedly "
+                  f"(exit code {self._process.exitcode}); emotion detection is disabled.")
+            self._worker_died = True
+            return False
+        return True
+
+    def submit(self, face_crops):
+        """
+        Hands the face crops from one frame to the worker without blocking.
+        Only the first EMOTION_BATCH_SIZE faces are sent.
+
+        Returns:
+            True if the crops were accepted, or False if the worker is too
+            far behind or has died (in which case they are dropped).
+        """
+        face_crops = [c for c in face_crops if c is not None and c.size > 0][:EMOTION_BATCH_SIZE]
+        if not face_crops or not self._worker_alive() or self._in.full():
+            return False
+
+        # Shrink each crop straight into the next free shared-memory slot
+        slot = self._next_slot
+        for i, crop in enumerate(face_crops):
+            self._slots[slot, i] = cv2.resize(crop, EMOTION_INPUT_SIZE, interpolation=cv2.INTER_AREA)
+        try:
+            self._in.put_nowait((slot, len(face_crops)))
+        except queue.Full:
+            return False
+        self._next_slot = (slot + 1) % self._slots_shape[0]
+        return True
+
+    def get_latest(self):
+        """
+        Returns the most recently detected emotion, or None if there is none yet
+        or the worker process has died.
+        """
+        if not self._worker_alive():
             return None
+        emotion_id = self._emotion_id.value
+        return EMOTIONS[emotion_id] if emotion_id >= 0 else None
+
+    def stop(self):
+        """
+        Asks the worker process to finish, waits for it, and frees the shared memory.
+        Safe to call more than once, and also if start() was never called.
+        """
+        if self._shm is None:
+            return
+        if self._process.is_alive():
+            # Clear any pending crops so the sentinel is guaranteed to fit
+            while True:
+                try:
+                    self._in.get_nowait()
+                except queue.Empty:
+                    break
+            try:
+                # Don't block forever if the worker dies and the queue stays full
+                self._in.put(None, timeout=1.0)
+                self._process.join(timeout=5.0)
+            except queue.Full:
+                pass
+            if self._process.is_alive():
+                self._process.terminate()
+        self._slots = None
+        self._shm.close()
+        self._shm.unlink()
+        self._shm = None
 
 # --- Example Usage ---
 if __name__ == '__main__':
     # This part runs only when you execute this script directly.
     # It's useful for testing the emotion detector with your webcam.
-    import cv2
+    import dlib
     
     detector = EmotionDetector()
+    face_detector = dlib.get_frontal_face_detector()
     cap = cv2.VideoCapture(0)
     
     print("Starting emotion detection test. Press 'q' to quit.")
@@ -79,8 +371,13 @@ if __name__ == '__main__':
         if not ret:
             break
             
-        # Analyze the frame to get the emotion
-        emotion = detector.analyze_frame(frame)
+        # Find the face first, then analyze just that part of the frame
+        emotion = None
+        rects = face_detector(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), 0)
+        if rects:
+            rect = rects[0]
+            emotion = detector.analyze_frame(
+                frame[max(0, rect.top()):rect.bottom(), max(0, rect.left()):rect.right()])
         
         # Display the detected emotion on the frame
         if emotion:
@@ -25,8 +25,9 @@ class ScreenFlasher:
         screen_height = self.root.winfo_screenheight()
         self.root.geometry(f"{screen_width}x{screen_height}+0+0")
         
-        # Keep the window on top of all others
+        # Keep the window on top of all others, fully opaque
         self.root.wm_attributes("-topmost", 1)
+        self.root.wm_attributes("-alpha", 1.0)
         
         # Set background to white once
         self.root.configure(bg='white')
@@ -40,15 +41,16 @@ class ScreenFlasher:
         Shows or hides the window based on the 'show' boolean argument.
         This method is intended to be called repeatedly from a main loop.
         """
-        # Show the window if it's supposed to be visible but currently isn't
-        if show and not self.is_showing:
+        # Nothing changed, so there is nothing for Tkinter to redraw
+        if show == self.is_showing:
+            return
+
+        if show:
             self.root.deiconify()
-            self.is_showing = True
-        # Hide the window if it's not supposed to be visible but currently is
-        elif not show and self.is_showing:
+        else:
             self.root.withdraw()
-            self.is_showing = False
-        
+        self.is_showing = show
+
         # Process Tkinter events to ensure the window updates correctly
         # when called from within another loop (like OpenCV's).
         self.root.update_idletasks()
@@ -0,0 +1,113 @@
+# Threaded Capture Script
+#
+# Description:
+# This script provides a class that reads frames from a camera on a
+# background thread. The main loop always gets the newest frame, and never
+# the same frame twice, so frame counters match real camera frames.
+#
+# Dependencies:
+# - opencv-python
+
+import threading
+import time
+import cv2
+
+
+class ThreadedCapture:
+    """
+    A class to continuously read frames from a video source in the background.
+    """
+    def __init__(self, src=0, width=640, height=480):
+        """
+        Opens the video source and reads a first frame so that read()
+        has something to return straight away.
+
+        Args:
+            src: The camera index or video path passed to cv2.VideoCapture.
+            width: The frame width to request from the camera.
+            height: The frame height to request from the camera.
+        """
+        self.cap = cv2.VideoCapture(src)
+        # Keep only one frame in the driver's queue so we never process stale frames
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        # Ask for compressed MJPG frames at a modest size to cut USB bandwidth.
+        # Cameras that don't support these settings simply ignore them.
+        self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
+        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        self.grabbed, self.frame = self.cap.read()
+        self.frame_time = time.monotonic()
+        # Each new frame gets a sequence number, so read() can tell whether
+        # it has already handed out the current one
+        self.frame_seq = 1
+        self.last_read_seq = 0
+        self.started = False
+        self.read_lock = threading.Lock()
+        self.frame_ready = threading.Condition(self.read_lock)
+        self.thread = None
+
+    def start(self):
+        """
+        Starts the background thread that keeps reading frames.
+        """
+        if self.started:
+            return self
+        self.started = True
+        self.thread = threading.Thread(target=self._update, daemon=True)
+        self.thread.start()
+        return self
+
+    def _update(self):
+        """
+        Keeps reading frames until stopped, storing only the newest one.
+        """
+        while self.started:
+            # grab() just waits for the next frame to arrive; retrieve() then
+            # decodes it. Splitting them lets us timestamp the frame on arrival.
+            grabbed = self.cap.grab()
+            frame_time = time.monotonic()
+            frame = None
+            if grabbed:
+                grabbed, frame = self.cap.retrieve()
+            with self.frame_ready:
+                self.grabbed = grabbed
+                self.frame = frame
+                self.frame_time = frame_time
+                self.frame_seq += 1
+                if not grabbed:
+                    # The camera was disconnected or the video ended
+                    self.started = False
+                self.frame_ready.notify_all()
+
+    def read(self):
+        """
+        Returns the next frame that hasn't been read yet, waiting for the camera
+        if needed, so the same frame is never processed twice. Any frames that
+        arrived while the caller was busy are skipped in favour of the newest.
+
+        Returns:
+            A tuple (frame, frame_time), where frame_time is the time.monotonic()
+            timestamp of when the frame arrived from the camera. Both are None if
+            the video ended or the capture was stopped.
+        """
+        with self.frame_ready:
+            self.frame_ready.wait_for(
+                lambda: self.frame_seq != self.last_read_seq or not self.started)
+            if not self.grabbed or self.frame_seq == self.last_read_seq:
+                return None, None
+            self.last_read_seq = self.frame_seq
+            # No copy needed: every frame is a fresh array from retrieve(), and
+            # this one is never handed out again
+            return self.frame, self.frame_time
+
+    def release(self):
+        """
+        Stops the background thread and releases the camera.
+        """
+        with self.frame_ready:
+            self.started = False
+            # Wake up any read() that is still waiting for a frame
+            self.frame_ready.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+        self.cap.release()